@@ -1,16 +1,24 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
+from sklearn.tree._tree import Tree
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
 import os
 import json
 import time
 from flask_cors import CORS
 import joblib
+import shutil
+import threading
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; JSON remains available without it
+    msgpack = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -18,9 +26,489 @@ CORS(app)  # Enable CORS for all routes
 # Create a directory for model storage
 os.makedirs('models', exist_ok=True)
 
-# Store models for each client
+# Directory holding versioned, memory-mapped model arrays shared by all worker processes
+HOSTED_MODELS_DIR = os.path.join('models', 'hosted')
+HOSTED_ARRAYS = ("roots", "left", "right", "feature", "threshold", "leaf_proba", "mean", "scale")
+HOSTED_VERSIONS_KEPT = 2
+
+# Store models for each client (per-process handles onto the hosted arrays, plus the
+# validation scores and metrics of the attached version)
 client_models = {}
-client_metrics = {}
+
+# Optional coalescing of concurrent single-row /predict calls (disabled when the window is 0).
+# Only useful with threaded or async workers; sync workers would just add the window as latency.
+PREDICT_COALESCE_WINDOW_MS = float(os.environ.get('PREDICT_COALESCE_WINDOW_MS', 0))
+PREDICT_COALESCE_MAX_ROWS = int(os.environ.get('PREDICT_COALESCE_MAX_ROWS', 64))
+
+# Request/response encodings accepted by the prediction endpoints
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+FLOAT_ARRAY_MIMETYPE = 'application/octet-stream'  # little-endian float64 rows in feature order
+FLOAT_ARRAY_DTYPE = np.dtype('<f8')
+
+def request_encoding():
+    """Return the encoding of the current request based on its Content-Type"""
+    if request.mimetype in MSGPACK_MIMETYPES:
+        return "msgpack"
+    if request.mimetype == FLOAT_ARRAY_MIMETYPE:
+        return "float-array"
+    return "json"
+
+def decode_request():
+    """Decode a JSON or msgpack request body into a dict (None if it is not a valid object)"""
+    if request_encoding() == "msgpack":
+        if msgpack is None:
+            return None
+        try:
+            data = msgpack.unpackb(request.get_data(), raw=False)
+        except (msgpack.UnpackException, ValueError):
+            return None
+    else:
+        data = request.json
+    return data if isinstance(data, dict) else None
+
+def encode_response(payload, status=200):
+    """Encode a response using the same encoding as the request (JSON by default)"""
+    if request_encoding() == "msgpack" and msgpack is not None:
+        return Response(msgpack.packb(payload, use_bin_type=True), status=status, mimetype=MSGPACK_MIMETYPES[0])
+    return jsonify(payload), status
+
+def decode_float_rows(n_features):
+    """Decode a fixed-layout float array request body into an (n_rows, n_features) matrix"""
+    body = request.get_data()
+    if n_features == 0 or len(body) % (FLOAT_ARRAY_DTYPE.itemsize * n_features) != 0:
+        return None
+    return np.frombuffer(body, dtype=FLOAT_ARRAY_DTYPE).reshape(-1, n_features)
+
+def encode_float_array(values):
+    """Encode fraud probabilities as a fixed-layout float array response"""
+    return Response(np.asarray(values, dtype=FLOAT_ARRAY_DTYPE).tobytes(), mimetype=FLOAT_ARRAY_MIMETYPE)
+
+def unsupported_encoding_response():
+    """Return an error for encodings that this service or endpoint cannot handle"""
+    return jsonify({"error": f"Unsupported Content-Type: {request.mimetype}"}), 415
+
+class HostedForest:
+    """Read-only random forest scorer backed by memory-mapped tree arrays
+    
+    All trees are flattened into shared node arrays, with leaves pointing to
+    themselves. Small inputs are walked directly over the shared arrays; large
+    inputs are scored with sklearn trees rebuilt from them for the call.
+    """
+    classes_ = np.array([0, 1])
+    chunk_rows = 1024
+    
+    def __init__(self, arrays, max_depth):
+        self.roots = arrays["roots"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.leaf_proba = arrays["leaf_proba"]
+        self.max_depth = max_depth
+    
+    def predict_proba(self, X):
+        # Trees compare float32 features, as sklearn does
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) >= self.chunk_rows:
+            fraud_proba = self.apply_trees(X)
+        else:
+            fraud_proba = self.walk(X)
+        return np.column_stack([1 - fraud_proba, fraud_proba])
+    
+    def walk(self, X):
+        """Return the mean fraud probability over all trees for each row of X"""
+        fraud_proba = np.empty(len(X))
+        for start in range(0, len(X), self.chunk_rows):
+            fraud_proba[start:start + self.chunk_rows] = self.walk_chunk(X[start:start + self.chunk_rows])
+        return fraud_proba
+    
+    def walk_chunk(self, X):
+        n_trees = len(self.roots)
+        leaves = np.empty(len(X) * n_trees, dtype=np.intp)
+        
+        # Active (row, tree) pairs: position in leaves, row index and current node
+        position = np.arange(len(leaves))
+        rows = position // n_trees
+        nodes = np.tile(self.roots, len(X))
+        while len(nodes):
+            left = self.left[nodes]
+            at_leaf = left == nodes
+            if at_leaf.any():
+                leaves[position[at_leaf]] = nodes[at_leaf]
+                walking = ~at_leaf
+                position, rows, nodes, left = position[walking], rows[walking], nodes[walking], left[walking]
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, left, self.right[nodes])
+        
+        return self.leaf_proba[leaves].reshape(len(X), n_trees).mean(axis=1)
+    
+    def apply_trees(self, X):
+        """Return the mean fraud probability over all trees, finding leaves with sklearn's Tree.apply"""
+        n_classes = np.array([2], dtype=np.intp)
+        node_dtype = Tree(X.shape[1], n_classes, 1).__getstate__()["nodes"].dtype
+        ends = np.append(self.roots[1:], len(self.left))
+        
+        fraud_proba = np.zeros(len(X))
+        for start, end in zip(self.roots, ends):
+            # Rebuild one tree at a time so only a single tree is copied out of shared memory
+            node_ids = np.arange(end - start)
+            left = self.left[start:end] - start
+            is_leaf = left == node_ids
+            nodes = np.zeros(end - start, dtype=node_dtype)
+            nodes["left_child"] = np.where(is_leaf, -1, left)
+            nodes["right_child"] = np.where(is_leaf, -1, self.right[start:end] - start)
+            nodes["feature"] = np.where(is_leaf, -2, self.feature[start:end])
+            nodes["threshold"] = np.where(is_leaf, -2, self.threshold[start:end])
+            
+            tree = Tree(X.shape[1], n_classes, 1)
+            tree.__setstate__({
+                "max_depth": self.max_depth,
+                "node_count": end - start,
+                "nodes": nodes,
+                "values": np.zeros((end - start, 1, 2))
+            })
+            fraud_proba += self.leaf_proba[tree.apply(X) + start]
+        return fraud_proba / len(self.roots)
+
+class HostedScaler:
+    """Read-only StandardScaler backed by memory-mapped parameters"""
+    
+    def __init__(self, mean, scale):
+        self.mean = mean
+        self.scale = scale
+    
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+
+def hosted_client_dir(client_id):
+    return os.path.join(HOSTED_MODELS_DIR, str(client_id))
+
+def publish_model(client_id, model, scaler, features, validation=None, validation_rows=None):
+    """Write a client's forest, scaler and validation scores and atomically make them the current version
+    
+    When the unscaled validation rows are given, the hosted scorer is checked
+    against the model's validation scores before the version is switched to.
+    """
+    client_dir = hosted_client_dir(client_id)
+    version = f"{time.time_ns()}-{os.getpid()}"
+    version_dir = os.path.join(client_dir, version)
+    os.makedirs(version_dir)
+    
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+    classes = list(model.classes_)
+    
+    left, right, feature, leaf_proba = [], [], [], []
+    for tree, offset in zip(trees, offsets):
+        node_ids = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+        left.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+        right.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        
+        # Per-node fraud probability, normalised as in RandomForestClassifier.predict_proba
+        value = tree.value[:, 0, :]
+        if 1 in classes:
+            leaf_proba.append(value[:, classes.index(1)] / value.sum(axis=1))
+        else:
+            leaf_proba.append(np.zeros(tree.node_count))
+    
+    arrays = {
+        "roots": offsets[:-1].astype(np.intp),
+        "left": np.concatenate(left).astype(np.intp),
+        "right": np.concatenate(right).astype(np.intp),
+        "feature": np.concatenate(feature).astype(np.intp),
+        "threshold": np.concatenate([tree.threshold for tree in trees]),
+        "leaf_proba": np.concatenate(leaf_proba),
+        "mean": scaler.mean_ if scaler.mean_ is not None else np.zeros(len(features)),
+        "scale": scaler.scale_ if scaler.scale_ is not None else np.ones(len(features))
+    }
+    for name in HOSTED_ARRAYS:
+        np.save(os.path.join(version_dir, f"{name}.npy"), arrays[name])
+    
+    if validation is not None:
+        np.savez(os.path.join(version_dir, "validation.npz"), **validation)
+    
+    with open(os.path.join(version_dir, "meta.json"), "w") as f:
+        json.dump({
+            "features": features,
+            "max_depth": max(tree.max_depth for tree in trees),
+            "lastUpdated": time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        }, f)
+    
+    if validation is not None and validation_rows is not None:
+        try:
+            check_hosted_scores(attach_model(client_id, version), validation_rows, validation["scores"])
+        except ValueError:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            raise
+    
+    # Switch workers to the new version by atomically replacing the pointer file
+    pointer_tmp = os.path.join(client_dir, f"CURRENT.{version}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(client_dir, "CURRENT"))
+    
+    prune_hosted_versions(client_id)
+    return version
+
+def check_hosted_scores(model_info, rows, expected):
+    """Raise if either hosted scoring path disagrees with the model's own predict_proba scores"""
+    X = np.asarray(model_info["scaler"].transform(rows), dtype=np.float32)
+    forest = model_info["model"]
+    for scores in (forest.walk(X), forest.apply_trees(X)):
+        if not np.allclose(scores, expected, rtol=0, atol=1e-9):
+            raise ValueError("Hosted model scores do not match RandomForestClassifier.predict_proba")
+
+def prune_hosted_versions(client_id):
+    """Remove old model versions, keeping the most recent ones for workers still switching over"""
+    client_dir = hosted_client_dir(client_id)
+    versions = sorted(
+        (entry for entry in os.listdir(client_dir) if os.path.isdir(os.path.join(client_dir, entry))),
+        key=lambda entry: int(entry.split("-")[0])
+    )
+    for version in versions[:-HOSTED_VERSIONS_KEPT]:
+        # Mapped files cannot be removed on some platforms; leave them for a later prune
+        shutil.rmtree(os.path.join(client_dir, version), ignore_errors=True)
+
+def current_model_version(client_id):
+    """Return the currently published model version for a client (None if never published)"""
+    try:
+        with open(os.path.join(hosted_client_dir(client_id), "CURRENT"), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def attach_model(client_id, version):
+    """Map a published model version read-only into this process"""
+    version_dir = os.path.join(hosted_client_dir(client_id), version)
+    arrays = {name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode='r') for name in HOSTED_ARRAYS}
+    
+    with open(os.path.join(version_dir, "meta.json"), "r") as f:
+        meta = json.load(f)
+    
+    model_info = {
+        "version": version,
+        "model": HostedForest(arrays, meta["max_depth"]),
+        "scaler": HostedScaler(arrays["mean"], arrays["scale"]),
+        "features": meta["features"],
+        "lastUpdated": meta["lastUpdated"]
+    }
+    
+    validation_path = os.path.join(version_dir, "validation.npz")
+    if os.path.exists(validation_path):
+        with np.load(validation_path) as cached:
+            model_info["validation"] = {key: cached[key] for key in cached.files}
+    return model_info
+
+def load_client_model(client_id):
+    """Return the model info for a client, attaching to the latest published version (None if not trained)"""
+    version = current_model_version(client_id)
+    model_info = client_models.get(client_id)
+    if model_info is not None and model_info["version"] == version:
+        return model_info
+    
+    if version is None:
+        # Models trained before hosting was added only exist as joblib files
+        model_path = f"models/model_{client_id}.joblib"
+        scaler_path = f"models/scaler_{client_id}.joblib"
+        features_path = f"models/features_{client_id}.json"
+        
+        if not (os.path.exists(model_path) and os.path.exists(scaler_path) and os.path.exists(features_path)):
+            return None
+            
+        with open(features_path, "r") as f:
+            features = json.load(f)
+        
+        version = publish_model(client_id, joblib.load(model_path), joblib.load(scaler_path), features)
+    
+    # Re-attaching drops the previous version's validation scores and metrics
+    while True:
+        try:
+            client_models[client_id] = attach_model(client_id, version)
+            return client_models[client_id]
+        except FileNotFoundError:
+            # Later retrains pruned this version before it was attached; follow CURRENT again
+            latest = current_model_version(client_id)
+            if latest is not None and latest != version:
+                version = latest
+            elif model_info is not None:
+                return model_info
+            else:
+                raise
+
+def transaction_to_row(transaction, features):
+    """Build a feature vector in model order, using 0 for missing features"""
+    return [transaction.get(feature, 0) for feature in features]
+
+def score_rows(model_info, rows):
+    """Return the fraud probability for each row of a feature matrix"""
+    scaled_features = model_info["scaler"].transform(np.asarray(rows, dtype=np.float64))
+    return fraud_probabilities(model_info["model"], scaled_features)
+
+class PredictionCoalescer:
+    """Score concurrent single-row requests for the same client as one matrix
+    
+    The first request for a client opens a batch and waits up to the window (or
+    until max_rows rows have joined), then scores the whole batch and hands each
+    waiting request its own result. Batches only form across requests handled
+    concurrently by one process (threaded or async workers); with synchronous
+    multi-process workers every request waits out the window alone.
+    """
+    
+    def __init__(self, window_ms, max_rows):
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.stats = {"batches": 0, "rows": 0, "totalQueueDelayMs": 0.0, "maxQueueDelayMs": 0.0}
+    
+    def score(self, client_id, model_info, row):
+        """Return the fraud probability for one row, scored together with concurrent rows"""
+        key = (client_id, model_info["version"])
+        item = {"row": row, "enqueued": time.perf_counter(), "done": threading.Event()}
+        
+        with self.lock:
+            batch = self.pending.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = {"items": [], "full": threading.Event()}
+                self.pending[key] = batch
+            batch["items"].append(item)
+            if len(batch["items"]) >= self.max_rows:
+                # Close the batch so later requests start a new one
+                del self.pending[key]
+                batch["full"].set()
+        
+        if is_leader:
+            batch["full"].wait(self.window)
+            with self.lock:
+                if self.pending.get(key) is batch:
+                    del self.pending[key]
+            self.run_batch(model_info, batch["items"])
+        else:
+            item["done"].wait()
+        
+        if "error" in item:
+            raise item["error"]
+        return item["score"]
+    
+    def run_batch(self, model_info, items):
+        started = time.perf_counter()
+        try:
+            for item, score in zip(items, score_rows(model_info, [item["row"] for item in items])):
+                item["score"] = score
+        except Exception as e:
+            for item in items:
+                item["error"] = e
+        
+        queue_delays_ms = [(started - item["enqueued"]) * 1000 for item in items]
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["rows"] += len(items)
+            self.stats["totalQueueDelayMs"] += sum(queue_delays_ms)
+            self.stats["maxQueueDelayMs"] = max(self.stats["maxQueueDelayMs"], max(queue_delays_ms))
+        
+        for item in items:
+            item["done"].set()
+    
+    def metrics(self):
+        """Return batch size and queueing delay statistics"""
+        with self.lock:
+            stats = dict(self.stats)
+        return {
+            "enabled": True,
+            "windowMs": self.window * 1000,
+            "maxRows": self.max_rows,
+            "batches": stats["batches"],
+            "rows": stats["rows"],
+            "meanBatchSize": stats["rows"] / stats["batches"] if stats["batches"] else 0.0,
+            "meanQueueDelayMs": stats["totalQueueDelayMs"] / stats["rows"] if stats["rows"] else 0.0,
+            "maxQueueDelayMs": stats["maxQueueDelayMs"]
+        }
+
+if PREDICT_COALESCE_WINDOW_MS > 0:
+    prediction_coalescer = PredictionCoalescer(PREDICT_COALESCE_WINDOW_MS, PREDICT_COALESCE_MAX_ROWS)
+else:
+    prediction_coalescer = None
+
+def prediction_result(client_id, prediction_proba):
+    """Format a single prediction"""
+    return {
+        "clientId": client_id,
+        "confidenceScore": float(prediction_proba),
+        "prediction": "fraud" if prediction_proba > 0.5 else "legitimate"
+    }
+
+def fraud_probabilities(model, X):
+    """Return the probability of the fraud class, even if training saw only one class"""
+    proba = model.predict_proba(X)
+    classes = list(model.classes_)
+    if 1 not in classes:
+        return np.zeros(len(proba))
+    return proba[:, classes.index(1)]
+
+def split_validation(df, X, y, test_size=0.2):
+    """Split features into train/validation sets
+    
+    Uses a temporal split on 'step' when present (the latest steps, up to
+    test_size of the rows, are held out), otherwise a stratified split. Falls
+    back to a plain random split when the minority class is too small to stratify.
+    """
+    if 'step' in df.columns:
+        # Hold out whole steps from the end while the held-out share stays within test_size
+        step_counts = df['step'].value_counts().sort_index(ascending=False)
+        held_out_steps = int((step_counts.cumsum() <= test_size * len(df)).sum())
+        if held_out_steps > 0:
+            cutoff = step_counts.index[held_out_steps]
+            test_mask = df['step'] > cutoff
+            # Training on a single class would only ever score zero
+            if (y[~test_mask] == 1).any():
+                return X[~test_mask], X[test_mask], y[~test_mask], y[test_mask], f"temporal split on 'step' (validation: step > {cutoff})"
+    
+    # Stratifying needs every class represented at least once on both sides
+    class_counts = y.value_counts()
+    n_test = int(np.ceil(test_size * len(y)))
+    if (len(class_counts) > 1 and class_counts.min() >= 2
+            and n_test >= len(class_counts) and len(y) - n_test >= len(class_counts)):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42, stratify=y)
+        return X_train, X_test, y_train, y_test, "stratified split"
+    
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42)
+    return X_train, X_test, y_train, y_test, "random split (too few samples to stratify)"
+
+def validation_metrics(validation, threshold=0.5):
+    """Compute metrics from cached held-out labels and scores without rescoring"""
+    y_true = validation["y_true"]
+    scores = validation["scores"]
+    y_pred = (scores > threshold).astype(int)
+    
+    # AUC is undefined when the validation set holds a single class
+    if len(np.unique(y_true)) > 1:
+        auc = float(roc_auc_score(y_true, scores))
+    else:
+        auc = None
+    
+    return {
+        "accuracy": float(accuracy_score(y_true, y_pred)),
+        "precision": float(precision_score(y_true, y_pred, zero_division=0)),
+        "recall": float(recall_score(y_true, y_pred, zero_division=0)),
+        "f1Score": float(f1_score(y_true, y_pred, zero_division=0)),
+        "auc": auc,
+        "dataVolume": int(validation["data_volume"]),
+        "fraudRatio": float(validation["fraud_ratio"]),
+        "threshold": float(threshold)
+    }
+
+def current_metrics(model_info):
+    """Return the validation metrics of an attached model version (None if unavailable)"""
+    if "validation" not in model_info:
+        return None
+    if "metrics" not in model_info:
+        metrics = validation_metrics(model_info["validation"])
+        metrics["lastUpdated"] = model_info["lastUpdated"]
+        model_info["metrics"] = metrics
+    return model_info["metrics"]
 
 @app.route('/train-model', methods=['POST'])
 def train_model():
@@ -76,10 +564,10 @@ def train_model():
     })
     
     # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, X_test, y_train, y_test, split_method = split_validation(df, X, y)
     
     logs.append({
-        "message": "Data split: 80% training, 20% validation", 
+        "message": f"Data split: {len(X_train)} training, {len(X_test)} validation ({split_method})", 
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
         "level": "info"
     })
@@ -120,6 +608,14 @@ def train_model():
     # Fit the model
     model.fit(X_train_scaled, y_train)
     
+    # Score the validation set once; labels and metrics are derived from these scores
+    validation = {
+        "y_true": y_test.to_numpy(),
+        "scores": fraud_probabilities(model, X_test_scaled),
+        "data_volume": np.array(len(df)),
+        "fraud_ratio": np.array(float(np.mean(y)))
+    }
+    
     # Save the model and scaler for this client
     model_path = f"models/model_{client_id}.joblib"
     scaler_path = f"models/scaler_{client_id}.joblib"
@@ -130,31 +626,21 @@ def train_model():
     with open(f"models/features_{client_id}.json", "w") as f:
         json.dump(numeric_cols, f)
     
-    # Store the model in memory for quick access
-    client_models[client_id] = {
-        "model": model,
-        "scaler": scaler,
-        "features": numeric_cols
-    }
-    
-    # Calculate metrics on test set
-    y_pred = model.predict(X_test_scaled)
-    y_proba = model.predict_proba(X_test_scaled)[:, 1]
-    
-    metrics = {
-        "accuracy": float(accuracy_score(y_test, y_pred)),
-        "precision": float(precision_score(y_test, y_pred, zero_division=0)),
-        "recall": float(recall_score(y_test, y_pred, zero_division=0)),
-        "f1Score": float(f1_score(y_test, y_pred, zero_division=0)),
-        "auc": float(roc_auc_score(y_test, y_proba)),
-        "dataVolume": len(df),
-        "fraudRatio": float(np.mean(y)),
-        "lastUpdated": time.strftime("%Y-%m-%dT%H:%M:%SZ")
-    }
+    # Publish the model with its validation scores; every worker switches to it on its next request
+    try:
+        publish_model(client_id, model, scaler, numeric_cols, validation, X_test)
+    except ValueError as e:
+        return jsonify({"error": f"Error publishing model: {str(e)}"}), 500
     
-    # Store metrics for this client
-    client_metrics[client_id] = metrics
+    # Calculate metrics on the validation set
+    metrics = current_metrics(load_client_model(client_id))
     
+    if metrics["auc"] is None:
+        logs.append({
+            "message": "Validation set contains a single class; AUC is not available", 
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "level": "warning"
+        })
     logs.append({
         "message": "Training completed successfully", 
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
@@ -178,96 +664,151 @@ def get_metrics():
     """Get metrics for a trained model"""
     client_id = request.args.get('client_id')
     
-    if client_id not in client_metrics:
-        # Try to load model and calculate metrics
-        try:
-            model_path = f"models/model_{client_id}.joblib"
-            if os.path.exists(model_path):
-                return jsonify({"error": "Model exists but metrics not available"}), 404
-            else:
-                return jsonify({"error": "No metrics available for this client"}), 404
-        except Exception as e:
-            return jsonify({"error": f"Error loading model: {str(e)}"}), 500
+    try:
+        model_info = load_client_model(client_id)
+    except Exception as e:
+        return jsonify({"error": f"Error loading model: {str(e)}"}), 500
+    
+    if model_info is None:
+        return jsonify({"error": "No metrics available for this client"}), 404
+    
+    metrics = current_metrics(model_info)
+    if metrics is None:
+        return jsonify({"error": "Model exists but metrics not available"}), 404
             
-    return jsonify(client_metrics[client_id])
+    return jsonify(metrics)
+
+@app.route('/model-features', methods=['GET'])
+def get_model_features():
+    """Get the feature order expected by float array requests to /predict and /predict-batch"""
+    client_id = request.args.get('client_id')
+    
+    try:
+        model_info = load_client_model(client_id)
+    except Exception as e:
+        return jsonify({"error": f"Error loading model: {str(e)}"}), 500
+    
+    if model_info is None:
+        return jsonify({"error": "No model trained for this client"}), 404
+    
+    return jsonify({"clientId": client_id, "features": model_info["features"]})
+
+@app.route('/validation-metrics', methods=['GET'])
+def get_validation_metrics():
+    """Recompute validation metrics at a given decision threshold from cached scores"""
+    client_id = request.args.get('client_id')
+    threshold = request.args.get('threshold', 0.5, type=float)
+    
+    try:
+        model_info = load_client_model(client_id)
+    except Exception as e:
+        return jsonify({"error": f"Error loading model: {str(e)}"}), 500
+    
+    if model_info is None or "validation" not in model_info:
+        return jsonify({"error": "No validation scores available for this client"}), 404
+    
+    metrics = validation_metrics(model_info["validation"], threshold)
+    metrics["lastUpdated"] = model_info["lastUpdated"]
+    return jsonify(metrics)
+
+@app.route('/coalescer-metrics', methods=['GET'])
+def get_coalescer_metrics():
+    """Get batch size and queueing delay statistics for /predict request coalescing"""
+    if prediction_coalescer is None:
+        return jsonify({"enabled": False})
+    return jsonify(prediction_coalescer.metrics())
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    """Make a prediction on transaction data"""
-    data = request.json
-    client_id = data.get('client_id')
-    transaction = data.get('transaction')
+    """Make a prediction on transaction data
     
-    if not client_id or not transaction:
-        return jsonify({"error": "Missing client_id or transaction data"}), 400
+    Accepts JSON (default), msgpack, or a fixed-layout float array of one row in
+    feature order (client_id passed as a query parameter). The response uses the
+    same encoding as the request.
+    """
+    return predict_rows(batch=False)
+
+@app.route('/predict-batch', methods=['POST'])
+def predict_batch():
+    """Make predictions on a batch of transactions
+    
+    Same encodings as /predict; JSON and msgpack bodies carry a 'transactions' list
+    and a float array body may hold any number of rows.
+    """
+    return predict_rows(batch=True)
+
+def predict_rows(batch):
+    """Shared handler for /predict and /predict-batch"""
+    encoding = request_encoding()
+    if encoding == "msgpack" and msgpack is None:
+        return unsupported_encoding_response()
+    
+    if encoding == "float-array":
+        client_id = request.args.get('client_id')
+        if not client_id:
+            return jsonify({"error": "Missing client_id"}), 400
+    else:
+        data = decode_request()
+        if data is None:
+            return encode_response({"error": "Request body must be an object"}, 400)
+        client_id = data.get('client_id')
+        transactions = data.get('transactions') if batch else [data.get('transaction')]
+        
+        if not client_id or not transactions or not all(transactions):
+            return encode_response({"error": "Missing client_id or transaction data"}, 400)
+        if not isinstance(transactions, list) or not all(isinstance(transaction, dict) for transaction in transactions):
+            return encode_response({"error": "Transactions must be objects"}, 400)
     
     # Load model for this client
-    if client_id not in client_models:
-        try:
-            model_path = f"models/model_{client_id}.joblib"
-            scaler_path = f"models/scaler_{client_id}.joblib"
-            features_path = f"models/features_{client_id}.json"
-            
-            if not (os.path.exists(model_path) and os.path.exists(scaler_path) and os.path.exists(features_path)):
-                return jsonify({"error": "No model trained for this client"}), 404
-                
-            model = joblib.load(model_path)
-            scaler = joblib.load(scaler_path)
-            
-            with open(features_path, "r") as f:
-                features = json.load(f)
-                
-            client_models[client_id] = {
-                "model": model,
-                "scaler": scaler,
-                "features": features
-            }
-        except Exception as e:
-            return jsonify({"error": f"Error loading model: {str(e)}"}), 500
+    try:
+        model_info = load_client_model(client_id)
+    except Exception as e:
+        return encode_response({"error": f"Error loading model: {str(e)}"}, 500)
+    if model_info is None:
+        return encode_response({"error": "No model trained for this client"}, 404)
     
-    # Extract features from transaction
-    model_info = client_models[client_id]
     features = model_info["features"]
-    scaler = model_info["scaler"]
-    model = model_info["model"]
     
-    # Create a feature vector
     try:
-        feature_vector = []
-        for feature in features:
-            if feature in transaction:
-                feature_vector.append(transaction[feature])
-            else:
-                # For missing features, use 0
-                feature_vector.append(0)
+        if encoding == "float-array":
+            rows = decode_float_rows(len(features))
+            if rows is None or len(rows) == 0 or (not batch and len(rows) != 1):
+                return jsonify({"error": f"Expected float64 rows of {len(features)} features"}), 400
+        else:
+            rows = [transaction_to_row(transaction, features) for transaction in transactions]
         
-        # Convert to numpy array
-        feature_vector = np.array(feature_vector).reshape(1, -1)
+        if not batch and prediction_coalescer is not None:
+            probabilities = [prediction_coalescer.score(client_id, model_info, rows[0])]
+        else:
+            probabilities = score_rows(model_info, rows)
         
-        # Scale features
-        scaled_features = scaler.transform(feature_vector)
+        if encoding == "float-array":
+            return encode_float_array(probabilities)
         
-        # Make prediction
-        prediction_proba = model.predict_proba(scaled_features)[0, 1]  # Probability of fraud
-        prediction = "fraud" if prediction_proba > 0.5 else "legitimate"
+        results = [prediction_result(client_id, proba) for proba in probabilities]
         
-        return jsonify({
-            "clientId": client_id,
-            "confidenceScore": float(prediction_proba),
-            "prediction": prediction
-        })
+        if batch:
+            return encode_response({"clientId": client_id, "results": results})
+        return encode_response(results[0])
     except Exception as e:
-        return jsonify({"error": f"Error making prediction: {str(e)}"}), 500
+        return encode_response({"error": f"Error making prediction: {str(e)}"}, 500)
 
 @app.route('/ers', methods=['POST'])
 def apply_ers():
-    """Apply expert rules system to a transaction"""
-    data = request.json
+    """Apply expert rules system to a transaction (JSON or msgpack)"""
+    if request_encoding() == "float-array" or (request_encoding() == "msgpack" and msgpack is None):
+        return unsupported_encoding_response()
+    
+    data = decode_request()
+    if data is None:
+        return encode_response({"error": "Request body must be an object"}, 400)
     transaction = data.get('transaction')
     score = data.get('score', 0.5)  # Default score if not provided
     
     if not transaction:
-        return jsonify({"error": "Missing transaction data"}), 400
+        return encode_response({"error": "Missing transaction data"}, 400)
+    if not isinstance(transaction, dict):
+        return encode_response({"error": "Transactions must be objects"}, 400)
     
     # Define expert rules
     rules = {
@@ -287,7 +828,7 @@ def apply_ers():
     triggered = len(matched_rules) > 0
     decision = "fraud" if len(matched_rules) >= 2 else "legitimate"
     
-    return jsonify({
+    return encode_response({
         "triggered": triggered,
         "matchedRules": matched_rules,
         "decision": decision
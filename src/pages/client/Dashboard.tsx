@@ -213,7 +213,7 @@ const ClientDashboard = () => {
                       <div className="space-y-1">
                         <p className="text-slate-500">AUC</p>
                         <p className="font-semibold">
-                          {(clientStatus.metrics.auc * 100).toFixed(1)}%
+                          {clientStatus.metrics.auc === null ? "N/A" : `${(clientStatus.metrics.auc * 100).toFixed(1)}%`}
                         </p>
                       </div>
                     </div>
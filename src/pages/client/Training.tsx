@@ -293,7 +293,7 @@ const ClientTraining = () => {
                           <div className="space-y-1">
                             <p className="text-sm text-slate-500">AUC</p>
                             <p className="text-2xl font-semibold">
-                              {(metrics.auc * 100).toFixed(1)}%
+                              {metrics.auc === null ? "N/A" : `${(metrics.auc * 100).toFixed(1)}%`}
                             </p>
                           </div>
                           <div className="space-y-1">
@@ -163,7 +163,7 @@ const ServerDashboard = () => {
                         <div className="grid grid-cols-2 gap-2">
                           <div className="flex flex-col">
                             <span className="text-slate-500">AUC</span>
-                            <span className="font-medium">{(client.metrics.auc * 100).toFixed(1)}%</span>
+                            <span className="font-medium">{client.metrics.auc === null ? "N/A" : `${(client.metrics.auc * 100).toFixed(1)}%`}</span>
                           </div>
                           <div className="flex flex-col">
                             <span className="text-slate-500">Data Volume</span>
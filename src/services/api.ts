@@ -19,7 +19,7 @@ export interface TrainingMetrics {
   precision: number;
   recall: number;
   f1Score: number;
-  auc: number;
+  auc: number | null;
   dataVolume: number;
   fraudRatio: number;
   lastUpdated: string;